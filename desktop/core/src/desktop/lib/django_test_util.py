@@ -36,12 +36,13 @@ class Client(django.test.client.Client):
 
 
 def make_logged_in_client(
-  username="test", password="test", is_superuser=True, recreate=False, groupname=None, is_admin=False, request=None
+  username="test", password="test", is_superuser=True, recreate=False, groupname=None, is_admin=False, request=None, force_login=False
 ):
   """
   Create a client with a user already logged in.
 
   Sometimes we recreate the user, because some tests like to mess with is_active and such.
+  With force_login, a new user gets no password and the session is opened with Client.force_login(), skipping password hashing.
   Note: could be combined with backend.create_user and other standart utils.
   """
   request = Mock()
@@ -51,7 +52,7 @@ def make_logged_in_client(
       user.delete()
       raise User.DoesNotExist
   except User.DoesNotExist:
-    user = User.objects.create_user(username=username, password=password)
+    user = User.objects.create_user(username=username, password=None if force_login else password)
     user.is_superuser = is_superuser
     if ENABLE_ORGANIZATIONS.get():
       user.is_admin = is_admin
@@ -75,6 +76,10 @@ def make_logged_in_client(
       user.save()
 
   c = Client()
+  if force_login:
+    c.force_login(user)
+    return c
+
   ret = c.login(username=username, password=password, request=request)
 
   assert ret, "Login failed (user '%s')." % username
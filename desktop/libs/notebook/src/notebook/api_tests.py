@@ -15,19 +15,27 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import copy
 import json
+import textwrap
+import functools
 from collections import OrderedDict
+from operator import itemgetter
 from unittest.mock import Mock, patch
+from urllib.parse import urlencode
 
 import pytest
-from django.test.client import Client
-from django.urls import reverse
+from django.db import transaction
+from django.db.models import Count, Q
+from django.test.client import Client, RequestFactory
+from django.urls import resolve, reverse_lazy
 
 import notebook.conf
 import notebook.connectors.hiveserver2
 from azure.conf import is_adls_enabled
 from desktop import appmanager
 from desktop.conf import APP_BLACKLIST, ENABLE_CONNECTORS, ENABLE_PROMETHEUS
+from desktop.lib.connectors.models import Connector
 from desktop.lib.django_test_util import make_logged_in_client
 from desktop.lib.test_utils import add_permission, grant_access
 from desktop.metrics import num_of_queries
@@ -37,50 +45,205 @@ from notebook.api import _historify
 from notebook.conf import ENABLE_ALL_INTERPRETERS, INTERPRETERS, INTERPRETERS_SHOWN_ON_WHEEL, get_ordered_interpreters
 from notebook.connectors.base import Api, Notebook, QueryError, QueryExpired
 from notebook.decorators import api_error_handler
-from useradmin.models import User
+from useradmin.models import Group, GroupPermission, HuePermission, User
+
+_NOTEBOOK_TEMPLATE = textwrap.dedent(
+  """
+  {
+    "selectedSnippet": "hive",
+    "showHistory": false,
+    "description": "%(name)s",
+    "name": "%(name)s",
+    "sessions": [
+        {
+            "type": "hive",
+            "properties": [],
+            "id": null
+        }
+    ],
+    "type": "%(type)s",
+    "id": %(id)s,
+    "snippets": [%(snippet)s],
+    "uuid": "%(uuid)s",
+    "isSaved": false,
+    "parentUuid": null
+  }
+  """
+)
+
+_METASTORE_SNIPPET = (
+  """{"id":"2b7d1f46-17a0-30af-efeb-33d4c29b1055","type":"hive","status":"running","statement_raw":"""
+  """"select * from default.web_logs where app = '${app_name}';","variables":[{"name":"app_name","value":"metastore"}],"""
+  """"statement":"select * from default.web_logs where app = 'metastore';","properties":{"settings":[],"files":[],"""
+  """"functions":[]},"result":{"id":"b424befa-f4f5-8799-a0b4-79753f2552b1","type":"table","handle":{"log_context":null,"""
+  """"statements_count":1,"end":{"column":21,"row":0},"statement_id":0,"has_more_statements":false,"""
+  """"start":{"column":0,"row":0},"secret":"rVRWw7YPRGqPT7LZ/TeFaA==an","has_result_set":true,"statement":"""
+  """"select * from default.web_logs where app = 'metastore';","operation_type":0,"modified_row_count":null,"""
+  """"guid":"7xm6+epkRx6dyvYvGNYePA==an"}},"lastExecuted": 1462554843817,"database":"default"}"""
+)
+
+_SELECT_ONE_SNIPPET = (
+  """{"id":"2b7d1f46-17a0-30af-efeb-33d4c29b1055","type":"hive","status":"running","statement_raw":"""
+  """"select * from default.web_logs where app = '${app_name}';","variables":"""
+  """[{"name":"app_name","value":"metastore"}],"statement":"""
+  """"select 1;","properties":{"settings":[],"files":[],"functions":[]},"""
+  """"result":{"id":"b424befa-f4f5-8799-a0b4-79753f2552b1","type":"table","handle":{"log_context":null,"""
+  """"statements_count":1,"end":{"column":21,"row":0},"statement_id":0,"has_more_statements":false,"""
+  """"start":{"column":0,"row":0},"secret":"rVRWw7YPRGqPT7LZ/TeFaA==an","has_result_set":true,"""
+  """"statement":"select * from default.web_logs where app = 'metastore';","operation_type":0,"""
+  """"modified_row_count":null,"guid":"7xm6"}},"lastExecuted": 1462554843817,"database":"default"}"""
+)
+
+_WEB_LOGS_SNIPPET = (
+  """{"id":"2b7d1f46-17a0-30af-efeb-33d4c29b1055","type":"hive","status":"running","statement":"""
+  """"select * from web_logs","properties":{"settings":[],"variables":[],"files":[],"functions":[]},"""
+  """"result":{"id":"b424befa-f4f5-8799-a0b4-79753f2552b1","type":"table","handle":{"log_context":null,"""
+  """"statements_count":1,"end":{"column":21,"row":0},"statement_id":0,"has_more_statements":false,"""
+  """"start":{"column":0,"row":0},"secret":"rVRWw7YPRGqPT7LZ/TeFaA==an","has_result_set":true,"statement":"""
+  """"select * from web_logs","operation_type":0,"modified_row_count":null,"guid":"7xm6+epkRx6dyvYvGNYePA==an"}},"""
+  """"lastExecuted": 1462554843817,"database":"default"}"""
+)
+
+_TRASH_SNIPPET = (
+  """{"id": "e069ef32-5c95-4507-b961-e79c090b5abf","type":"hive","status":"ready","database":"default","""
+  """"statement":"select * from web_logs","statement_raw":"select * from web_logs","variables":[],"properties":"""
+  """{"settings":[],"files":[],"functions":[]},"result":{}}"""
+)
+
+_NOTEBOOK_JSON = _NOTEBOOK_TEMPLATE % {
+  'name': 'Test Hive Query',
+  'type': 'query-hive',
+  'id': 50010,
+  'snippet': _METASTORE_SNIPPET,
+  'uuid': '5982a274-de78-083c-2efc-74f53dce744c',
+}
+_NOTEBOOK_OBJ = json.loads(_NOTEBOOK_JSON)
+
+_SAVE_NOTEBOOK_JSON = _NOTEBOOK_TEMPLATE % {
+  'name': 'Test Hive Query',
+  'type': 'query-hive',
+  'id': 'null',
+  'snippet': _METASTORE_SNIPPET,
+  'uuid': 'd9efdee1-ef25-4d43-b8f9-1a170f69a05a',
+}
+
+_ACTUAL_NOTEBOOK_JSON = _NOTEBOOK_TEMPLATE % {
+  'name': 'Test Notebook',
+  'type': 'notebook',
+  'id': 'null',
+  'snippet': _SELECT_ONE_SNIPPET,
+  'uuid': 'd9efdee1-ef25-4d43-b8f9-1a170f69a05a',
+}
+
+_TRASH_NOTEBOOK_JSON = _NOTEBOOK_TEMPLATE % {
+  'name': 'Test Hive Query',
+  'type': 'query-hive',
+  'id': 'null',
+  'snippet': _TRASH_SNIPPET,
+  'uuid': '8a20da5f-b69c-4843-b17d-dea5c74c41d1',
+}
+
+_EXPORT_NOTEBOOK_JSON = _NOTEBOOK_TEMPLATE % {
+  'name': 'Test Hive Query',
+  'type': 'query-hive',
+  'id': 'null',
+  'snippet': _WEB_LOGS_SNIPPET,
+  'uuid': 'd9efdee1-ef25-4d43-b8f9-1a170f69a05a',
+}
+_EXPORT_SNIPPET_JSON = json.dumps(json.loads(_EXPORT_NOTEBOOK_JSON)['snippets'][0])
+
+
+_URL_SAVE = reverse_lazy('notebook:save_notebook')
+_URL_DELETE = reverse_lazy('notebook:delete')
+_URL_EXPORT_RESULT = reverse_lazy('notebook:export_result')
+_URL_DOWNLOAD = reverse_lazy('notebook:download')
+_URL_GET_HISTORY = reverse_lazy('notebook:get_history')
+_URL_CLEAR_HISTORY = reverse_lazy('notebook:clear_history')
+_URL_EDITOR = reverse_lazy('notebook:editor')
+_URL_AUTOCOMPLETE_DATABASES = reverse_lazy('notebook:api_autocomplete_databases')
+_URL_AUTOCOMPLETE_TABLES = reverse_lazy('notebook:api_autocomplete_tables', kwargs={'database': 'database'})
+
+# Static POST bodies, urlencoded once instead of on every client.post()
+_FORM_CONTENT_TYPE = 'application/x-www-form-urlencoded'
+_SAVE_NOTEBOOK_BODY = urlencode({'notebook': _SAVE_NOTEBOOK_JSON})
+_ACTUAL_NOTEBOOK_BODY = urlencode({'notebook': _ACTUAL_NOTEBOOK_JSON})
+_TRASH_NOTEBOOK_BODY = urlencode({'notebook': _TRASH_NOTEBOOK_JSON})
+_CLEAR_HISTORY_BODY = urlencode({'notebook': _NOTEBOOK_JSON, 'doc_type': 'hive'})
+
+
+@pytest.fixture(scope="class")
+def class_transaction(django_db_setup, django_db_blocker):
+  """
+  Wraps a whole test class in one transaction so that the data created once per class is rolled back at the end,
+  while the django_db marker still rolls back each test to a savepoint of its own.
+  """
+  with django_db_blocker.unblock():
+    atomic = transaction.atomic()
+    atomic.__enter__()
+
+  yield
+
+  with django_db_blocker.unblock():
+    transaction.set_rollback(True)
+    atomic.__exit__(None, None, None)
+
+
+def _copy_client(client):
+  """
+  Shallow copy of a logged in test Client with its own cookie jar and defaults, so that a test can not alter the cookies of the next
+  one. The cookies are deep-copied because Client.login() and direct assignments update the shared Morsels in place.
+  """
+  clone = copy.copy(client)
+  clone.cookies = copy.deepcopy(client.cookies)
+  clone.defaults = dict(client.defaults)
+  return clone
+
+
+def _history_counts(name):
+  """
+  Counts in a single query the history Document2 whose name contains `name` and the Document linked to any Document2 whose name
+  contains `name`.
+  """
+  return Document2.objects.filter(name__contains=name).aggregate(
+    history=Count('id', filter=Q(is_history=True), distinct=True),
+    linked=Count('doc', distinct=True),
+  )
 
 
-@pytest.mark.django_db
+def _grant_access_bulk(groupname, apps):
+  """
+  Same as grant_access() on each of `apps` for the members of `groupname`, but with a single GroupPermission INSERT.
+  """
+  group, created = Group.objects.get_or_create(name=groupname)
+  perms = {perm.app: perm for perm in HuePermission.objects.filter(app__in=apps, action='access')}
+  for app in set(apps).difference(perms):
+    perms[app] = HuePermission.objects.create(app=app, action='access')
+
+  granted = set(GroupPermission.objects.filter(group=group, hue_permission__in=perms.values()).values_list('hue_permission_id', flat=True))
+  GroupPermission.objects.bulk_create(
+    [GroupPermission(group=group, hue_permission=perm) for perm in perms.values() if perm.id not in granted]
+  )
+
+
+@api_error_handler
+def _send_query_error(message):
+  raise QueryError(message=message)
+
+
+@pytest.mark.django_db(transaction=False)
 class TestApi(object):
-  def setup_method(self):
-    self.client = make_logged_in_client(username="test", groupname="default", recreate=True, is_superuser=False)
-    self.client_not_me = make_logged_in_client(username="not_perm_user", groupname="default", recreate=True, is_superuser=False)
+  @pytest.fixture(scope="class", autouse=True)
+  def setup_class_data(self, request, class_transaction, django_db_blocker):
+    cls = request.cls
 
-    self.user = User.objects.get(username="test")
-    self.user_not_me = User.objects.get(username="not_perm_user")
+    with django_db_blocker.unblock():
+      cls._cached_client = make_logged_in_client(username="test", groupname="default", recreate=True, is_superuser=False, force_login=True)
 
-    self.notebook_json = (
-      """
-      {
-        "selectedSnippet": "hive",
-        "showHistory": false,
-        "description": "Test Hive Query",
-        "name": "Test Hive Query",
-        "sessions": [
-            {
-                "type": "hive",
-                "properties": [],
-                "id": null
-            }
-        ],
-        "type": "query-hive",
-        "id": 50010,
-        "snippets": [{"id":"2b7d1f46-17a0-30af-efeb-33d4c29b1055","type":"hive","status":"running","statement_raw":"""
-      """"select * from default.web_logs where app = '${app_name}';","variables":[{"name":"app_name","value":"metastore"}],"""
-      """"statement":"select * from default.web_logs where app = 'metastore';","properties":{"settings":[],"files":[],"""
-      """"functions":[]},"result":{"id":"b424befa-f4f5-8799-a0b4-79753f2552b1","type":"table","handle":{"log_context":null,"""
-      """"statements_count":1,"end":{"column":21,"row":0},"statement_id":0,"has_more_statements":false,"""
-      """"start":{"column":0,"row":0},"secret":"rVRWw7YPRGqPT7LZ/TeFaA==an","has_result_set":true,"statement":"""
-      """"select * from default.web_logs where app = 'metastore';","operation_type":0,"modified_row_count":null,"""
-      """"guid":"7xm6+epkRx6dyvYvGNYePA==an"}},"lastExecuted": 1462554843817,"database":"default"}],
-        "uuid": "5982a274-de78-083c-2efc-74f53dce744c",
-        "isSaved": false,
-        "parentUuid": null
-    }
-    """
-    )
+      cls.user = User.objects.get(username="test")
 
-    self.notebook = json.loads(self.notebook_json)
+  def setup_method(self):
+    self.client = _copy_client(self._cached_client)
+    self.notebook = copy.deepcopy(_NOTEBOOK_OBJ)  # _historify() mutates the notebook
     self.doc2 = Document2.objects.create(id=50010, name=self.notebook['name'], type=self.notebook['type'], owner=self.user)
     self.doc1 = Document.objects.link(
       self.doc2, owner=self.user, name=self.doc2.name, description=self.doc2.description, extra=self.doc2.type
@@ -89,95 +252,36 @@ class TestApi(object):
   def test_save_notebook(self):
     # Test that saving a new document with a new parent will set the parent_directory
     home_dir = Document2.objects.get_home_directory(self.user)
-    assert home_dir.uuid == self.doc2.parent_directory.uuid
+    home_dir_uuid = home_dir.uuid
+    assert home_dir_uuid == self.doc2.parent_directory.uuid
 
     new_dir = Directory.objects.create(name='new_dir', owner=self.user, parent_directory=home_dir)
-    notebook_cp = self.notebook.copy()
+    notebook_cp = copy.deepcopy(self.notebook)
     notebook_cp.pop('id')
     notebook_cp['directoryUuid'] = new_dir.uuid
     notebook_json = json.dumps(notebook_cp)
 
-    response = self.client.post(reverse('notebook:save_notebook'), {'notebook': notebook_json})
+    response = self.client.post(_URL_SAVE, {'notebook': notebook_json})
     data = json.loads(response.content)
 
     assert 0 == data['status'], data
-    doc = Document2.objects.get(pk=data['id'])
+    doc = Document2.objects.select_related('parent_directory').get(pk=data['id'])
     assert new_dir.uuid == doc.parent_directory.uuid
 
     # Test that saving a new document with a no parent will map it to its home dir
-    notebook_json = (
-      """
-      {
-        "selectedSnippet": "hive",
-        "showHistory": false,
-        "description": "Test Hive Query",
-        "name": "Test Hive Query",
-        "sessions": [
-            {
-                "type": "hive",
-                "properties": [],
-                "id": null
-            }
-        ],
-        "type": "query-hive",
-        "id": null,
-        "snippets": [{"id":"2b7d1f46-17a0-30af-efeb-33d4c29b1055","type":"hive","status":"running","statement_raw":"""
-      """"select * from default.web_logs where app = '${app_name}';","variables":"""
-      """[{"name":"app_name","value":"metastore"}],"statement":"""
-      """"select * from default.web_logs where app = 'metastore';","properties":{"settings":[],"files":[],"functions":[]},"""
-      """"result":{"id":"b424befa-f4f5-8799-a0b4-79753f2552b1","type":"table","handle":{"log_context":null,"""
-      """"statements_count":1,"end":{"column":21,"row":0},"statement_id":0,"has_more_statements":false,"""
-      """"start":{"column":0,"row":0},"secret":"rVRWw7YPRGqPT7LZ/TeFaA==an","has_result_set":true,"""
-      """"statement":"select * from default.web_logs where app = 'metastore';","operation_type":0,"""
-      """"modified_row_count":null,"guid":"7xm6+epkRx6dyvYvGNYePA==an"}},"lastExecuted": 1462554843817,"database":"default"}],
-        "uuid": "d9efdee1-ef25-4d43-b8f9-1a170f69a05a"
-    }
-    """
-    )
-
-    response = self.client.post(reverse('notebook:save_notebook'), {'notebook': notebook_json})
+    response = self.client.post(_URL_SAVE, _SAVE_NOTEBOOK_BODY, content_type=_FORM_CONTENT_TYPE)
     data = json.loads(response.content)
 
     assert 0 == data['status'], data
-    doc = Document2.objects.get(pk=data['id'])
-    assert Document2.objects.get_home_directory(self.user).uuid == doc.parent_directory.uuid
+    doc = Document2.objects.select_related('parent_directory').get(pk=data['id'])
+    assert home_dir_uuid == doc.parent_directory.uuid
 
     # Test that saving a notebook will save the search field to the first statement text
     assert doc.search == "select * from default.web_logs where app = 'metastore';"
     assert doc.type == "query-hive"
 
   def test_type_when_saving_an_actual_notebook(self):
-    notebook_json = (
-      """
-      {
-        "selectedSnippet": "hive",
-        "showHistory": false,
-        "description": "Test Notebook",
-        "name": "Test Notebook",
-        "sessions": [
-            {
-                "type": "hive",
-                "properties": [],
-                "id": null
-            }
-        ],
-        "type": "notebook",
-        "id": null,
-        "snippets": [{"id":"2b7d1f46-17a0-30af-efeb-33d4c29b1055","type":"hive","status":"running","statement_raw":"""
-      """"select * from default.web_logs where app = '${app_name}';","variables":"""
-      """[{"name":"app_name","value":"metastore"}],"statement":"""
-      """"select 1;","properties":{"settings":[],"files":[],"functions":[]},"""
-      """"result":{"id":"b424befa-f4f5-8799-a0b4-79753f2552b1","type":"table","handle":{"log_context":null,"""
-      """"statements_count":1,"end":{"column":21,"row":0},"statement_id":0,"has_more_statements":false,"""
-      """"start":{"column":0,"row":0},"secret":"rVRWw7YPRGqPT7LZ/TeFaA==an","has_result_set":true,"""
-      """"statement":"select * from default.web_logs where app = 'metastore';","operation_type":0,"""
-      """"modified_row_count":null,"guid":"7xm6"}},"lastExecuted": 1462554843817,"database":"default"}],
-                      "uuid": "d9efdee1-ef25-4d43-b8f9-1a170f69a05a"
-                  }
-                  """
-    )
-
-    response = self.client.post(reverse('notebook:save_notebook'), {'notebook': notebook_json})
+    response = self.client.post(_URL_SAVE, _ACTUAL_NOTEBOOK_BODY, content_type=_FORM_CONTENT_TYPE)
     data = json.loads(response.content)
 
     assert 0 == data['status'], data
@@ -189,7 +293,7 @@ class TestApi(object):
   def test_save_notebook_with_connector_off(self):
     reset = ENABLE_CONNECTORS.set_for_testing(False)
 
-    notebook_cp = self.notebook.copy()
+    notebook_cp = copy.deepcopy(self.notebook)
     notebook_cp.pop('id')
     notebook_cp['snippets'][0]['connector'] = {
       'name': 'MySql',  # At some point even v1 should set those two
@@ -199,7 +303,7 @@ class TestApi(object):
     notebook_json = json.dumps(notebook_cp)
 
     try:
-      response = self.client.post(reverse('notebook:save_notebook'), {'notebook': notebook_json})
+      response = self.client.post(_URL_SAVE, {'notebook': notebook_json})
       data = json.loads(response.content)
     finally:
       reset()
@@ -212,7 +316,7 @@ class TestApi(object):
     if not ENABLE_CONNECTORS.get():
       pytest.skip("Skipping Test")
 
-    notebook_cp = self.notebook.copy()
+    notebook_cp = copy.deepcopy(self.notebook)
     notebook_cp.pop('id')
 
     connector = Connector.objects.create(name='MySql', dialect='mysql')
@@ -224,8 +328,10 @@ class TestApi(object):
       'optimizer': 'api',
     }
 
+    notebook_json = json.dumps(notebook_cp)
+
     try:
-      response = self.client.post(reverse('notebook:save_notebook'), {'notebook': notebook_json})
+      response = self.client.post(_URL_SAVE, {'notebook': notebook_json})
       data = json.loads(response.content)
     finally:
       connector.delete()
@@ -236,35 +342,32 @@ class TestApi(object):
 
   def test_historify(self):
     # Starts with no history
-    assert 0 == Document2.objects.filter(name__contains=self.notebook['name'], is_history=True).count()
-    assert 1 == Document.objects.filter(name__contains=self.notebook['name']).count()
+    assert {'history': 0, 'linked': 1} == _history_counts(self.notebook['name'])
 
     history_doc = _historify(self.notebook, self.user)
 
     assert history_doc.id > 0
 
     # Test that historify creates new Doc2 and linked Doc1
-    assert 1 == Document2.objects.filter(name__contains=self.notebook['name'], is_history=True).count()
-    assert 2 == Document.objects.filter(name__contains=self.notebook['name']).count()
+    assert {'history': 1, 'linked': 2} == _history_counts(self.notebook['name'])
 
     # Historify again
     history_doc = _historify(self.notebook, self.user)
 
-    assert 2 == Document2.objects.filter(name__contains=self.notebook['name'], is_history=True).count()
-    assert 3 == Document.objects.filter(name__contains=self.notebook['name']).count()
+    assert {'history': 2, 'linked': 3} == _history_counts(self.notebook['name'])
 
   def test_get_history(self):
-    assert 0 == Document2.objects.filter(name__contains=self.notebook['name'], is_history=True).count()
+    assert 0 == _history_counts(self.notebook['name'])['history']
     _historify(self.notebook, self.user)
     _historify(self.notebook, self.user)
     _historify(self.notebook, self.user)
-    assert 3 == Document2.objects.filter(name__contains=self.notebook['name'], is_history=True).count()
+    assert 3 == _history_counts(self.notebook['name'])['history']
 
     # History should not return history objects that don't have the given doc type
-    Document2.objects.create(name='Impala History', type='query-impala', data=self.notebook_json, owner=self.user, is_history=True)
+    Document2.objects.create(name='Impala History', type='query-impala', data=_NOTEBOOK_JSON, owner=self.user, is_history=True)
 
     # Verify that get_history API returns history objects for given type and current user
-    response = self.client.get(reverse('notebook:get_history'), {'doc_type': 'hive'})
+    response = self.client.get(_URL_GET_HISTORY, {'doc_type': 'hive'})
     data = json.loads(response.content)
     assert 0 == data['status'], data
     assert 3 == len(data['history']), data
@@ -273,57 +376,34 @@ class TestApi(object):
     # TODO: test that query history for shared query only returns docs accessible by current user
 
   def test_clear_history(self):
-    assert 0 == Document2.objects.filter(name__contains=self.notebook['name'], is_history=True).count()
+    assert 0 == _history_counts(self.notebook['name'])['history']
     _historify(self.notebook, self.user)
     _historify(self.notebook, self.user)
     _historify(self.notebook, self.user)
-    assert 3 == Document2.objects.filter(name__contains=self.notebook['name'], is_history=True).count()
+    assert 3 == _history_counts(self.notebook['name'])['history']
 
     # Clear history should not clear history objects that don't have the given doc type
     Document2.objects.create(name='Impala History', type='query-impala', owner=self.user, is_history=True)
 
     # clear history should retain original document but wipe history
-    response = self.client.post(reverse('notebook:clear_history'), {'notebook': self.notebook_json, 'doc_type': 'hive'})
+    response = self.client.post(_URL_CLEAR_HISTORY, _CLEAR_HISTORY_BODY, content_type=_FORM_CONTENT_TYPE)
     data = json.loads(response.content)
     assert 0 == data['status'], data
-    assert not Document2.objects.filter(type='query-hive', is_history=True).exists()
-    assert Document2.objects.filter(type='query-hive', is_history=False).exists()
-    assert Document2.objects.filter(type='query-impala', is_history=True).exists()
+    remaining = set(Document2.objects.filter(type__in=('query-hive', 'query-impala')).values_list('type', 'is_history'))
+    assert ('query-hive', True) not in remaining
+    assert ('query-hive', False) in remaining
+    assert ('query-impala', True) in remaining
 
   def test_delete_notebook(self):
-    trash_notebook_json = (
-      """
-        {
-          "selectedSnippet": "hive",
-          "showHistory": false,
-          "description": "Test Hive Query",
-          "name": "Test Hive Query",
-          "sessions": [
-              {
-                  "type": "hive",
-                  "properties": [],
-                  "id": null
-              }
-          ],
-          "type": "query-hive",
-          "id": null,
-          "snippets": [{"id": "e069ef32-5c95-4507-b961-e79c090b5abf","type":"hive","status":"ready","database":"default","""
-      """"statement":"select * from web_logs","statement_raw":"select * from web_logs","variables":[],"properties":"""
-      """{"settings":[],"files":[],"functions":[]},"result":{}}],
-          "uuid": "8a20da5f-b69c-4843-b17d-dea5c74c41d1"
-      }
-      """
-    )
-
     # Assert that the notebook is first saved
-    response = self.client.post(reverse('notebook:save_notebook'), {'notebook': trash_notebook_json})
+    response = self.client.post(_URL_SAVE, _TRASH_NOTEBOOK_BODY, content_type=_FORM_CONTENT_TYPE)
     data = json.loads(response.content)
     assert 0 == data['status'], data
 
     # Test that deleting it moves it to the user's Trash folder
     notebook_doc = Document2.objects.get(id=data['id'])
     trash_notebooks = [Notebook(notebook_doc).get_data()]
-    response = self.client.post(reverse('notebook:delete'), {'notebooks': json.dumps(trash_notebooks)})
+    response = self.client.post(_URL_DELETE, {'notebooks': json.dumps(trash_notebooks)})
     data = json.loads(response.content)
     assert 0 == data['status'], data
     assert 'Trashed 1 notebook(s)' == data['message'], data
@@ -364,29 +444,22 @@ class TestApi(object):
       ],
     }
     trash_notebooks = [nonexistant_doc]
-    response = self.client.post(reverse('notebook:delete'), {'notebooks': json.dumps(trash_notebooks)})
+    response = self.client.post(_URL_DELETE, {'notebooks': json.dumps(trash_notebooks)})
     data = json.loads(response.content)
     assert 0 == data['status'], data
     assert 'Trashed 0 notebook(s) and failed to delete 1 notebook(s).' == data['message'], data
     assert ['ea22da5f-b69c-4843-b17d-dea5c74c41d1'] == data['errors']
 
-  def test_query_error_encoding(self):
-    @api_error_handler
-    def send_exception(message):
-      raise QueryError(message=message)
-
-    message = """SELECT a.key, a.* FROM customers c, c.addresses a"""
-    response = send_exception(message)
-    data = json.loads(response.content)
-    assert 1 == data['status']
-
-    message = """SELECT \u2002\u2002a.key, \u2002\u2002a.* FROM customers c, c.addresses a"""
-    response = send_exception(message)
-    data = json.loads(response.content)
-    assert 1 == data['status']
-
-    message = """SELECT a.key, a.* FROM déclenché c, c.addresses a"""
-    response = send_exception(message)
+  @pytest.mark.parametrize(
+    "message",
+    [
+      """SELECT a.key, a.* FROM customers c, c.addresses a""",
+      """SELECT \u2002\u2002a.key, \u2002\u2002a.* FROM customers c, c.addresses a""",
+      """SELECT a.key, a.* FROM déclenché c, c.addresses a""",
+    ],
+  )
+  def test_query_error_encoding(self, message):
+    response = _send_query_error(message)
     data = json.loads(response.content)
     assert 1 == data['status']
 
@@ -398,9 +471,7 @@ class TestApi(object):
         )
       )
 
-      response = self.client.post(
-        reverse('notebook:api_autocomplete_tables', kwargs={'database': 'database'}), {'snippet': json.dumps({'type': 'hive'})}
-      )
+      response = self.client.post(_URL_AUTOCOMPLETE_TABLES, {'snippet': json.dumps({'type': 'hive'})})
 
       data = json.loads(response.content)
       assert data == {'status': 0}  # We get back empty instead of failure with QueryExpired to silence end user messages
@@ -412,7 +483,7 @@ class TestApi(object):
       get_api.return_value = Mock(autocomplete=Mock(return_value={'functions': [{'name': 'f1'}, {'name': 'f2'}, {'name': 'f3'}]}))
 
       response = self.client.post(
-        reverse('notebook:api_autocomplete_databases'),
+        _URL_AUTOCOMPLETE_DATABASES,
         {'snippet': json.dumps({'type': 'hive', 'properties': {}}), 'operation': 'functions'},
       )
 
@@ -439,6 +510,9 @@ class MockedApi(Api):
 
 
 class MockFs(object):
+  _EXISTS = {'/user/hue/non_exists_directory': False}
+  _LISTDIR = {'/user/hue/non_empty_directory': ('mock_dir', 'mock_file')}
+
   def __init__(self, logical_name=None):
     self.fs_defaultfs = 'hdfs://curacao:8020'
     self.logical_name = logical_name if logical_name else ''
@@ -447,24 +521,16 @@ class MockFs(object):
     self._filebrowser_action = ''
 
   def setuser(self, user):
-    self._user = user
-
-  @property
-  def user(self):
-    return self._user
+    self.user = user
 
   def do_as_user(self, username, fn, *args, **kwargs):
     return ''
 
   def exists(self, path):
-    if path == '/user/hue/non_exists_directory':
-      return False
-    return True
+    return self._EXISTS.get(path, True)
 
   def listdir_stats(self, path):
-    if path == '/user/hue/non_empty_directory':
-      return ['mock_dir', 'mock_file']
-    return []
+    return list(self._LISTDIR.get(path, ()))
 
   def isdir(self, path):
     return path == '/user/hue'
@@ -472,79 +538,55 @@ class MockFs(object):
   def filebrowser_action(self):
     return self._filebrowser_action
 
-  @user.setter
-  def user(self, value):
-    self._user = value
 
+@pytest.fixture(scope="class")
+def mocked_hs2_and_fs():
+  """
+  Installs MockedApi as HS2Api and MockFs as the default filesystem once for the whole requesting class.
+  """
+  # Beware: Monkey patch HS2API Mock API
+  if not hasattr(notebook.connectors.hiveserver2, 'original_HS2Api'):  # Could not monkey patch base.get_api
+    notebook.connectors.hiveserver2.original_HS2Api = notebook.connectors.hiveserver2.HS2Api
+  notebook.connectors.hiveserver2.HS2Api = MockedApi
 
-@pytest.mark.django_db
-class TestNotebookApiMocked(object):
-  def setup_method(self):
-    self.client = make_logged_in_client(username="test", groupname="default", recreate=True, is_superuser=False)
-    self.client_not_me = make_logged_in_client(username="not_perm_user", groupname="default", recreate=True, is_superuser=False)
+  originalCluster.get_hdfs()
+  original_fs = originalCluster.FS_CACHE["default"]
+  originalCluster.FS_CACHE["default"] = MockFs()
+
+  yield
 
-    self.user = User.objects.get(username="test")
-    self.user_not_me = User.objects.get(username="not_perm_user")
+  notebook.connectors.hiveserver2.HS2Api = notebook.connectors.hiveserver2.original_HS2Api
 
-    # Beware: Monkey patch HS2API Mock API
-    if not hasattr(notebook.connectors.hiveserver2, 'original_HS2Api'):  # Could not monkey patch base.get_api
-      notebook.connectors.hiveserver2.original_HS2Api = notebook.connectors.hiveserver2.HS2Api
-    notebook.connectors.hiveserver2.HS2Api = MockedApi
+  if originalCluster.FS_CACHE is None:
+    originalCluster.FS_CACHE = {}
+  originalCluster.FS_CACHE["default"] = original_fs
 
-    originalCluster.get_hdfs()
-    self.original_fs = originalCluster.FS_CACHE["default"]
-    originalCluster.FS_CACHE["default"] = MockFs()
 
-    grant_access("test", "default", "notebook")
-    grant_access("test", "default", "beeswax")
-    grant_access("test", "default", "hive")
-    grant_access("not_perm_user", "default", "notebook")
-    grant_access("not_perm_user", "default", "beeswax")
-    grant_access("not_perm_user", "default", "hive")
-    add_permission('test', 'has_adls', permname='adls_access', appname='filebrowser')
+@pytest.mark.django_db(transaction=False)
+@pytest.mark.usefixtures("mocked_hs2_and_fs")
+class TestNotebookApiMocked(object):
+  @pytest.fixture(scope="class", autouse=True)
+  def setup_class_data(self, request, class_transaction, django_db_blocker):
+    cls = request.cls
+
+    with django_db_blocker.unblock():
+      cls._cached_client = make_logged_in_client(username="test", groupname="default", is_superuser=False, force_login=True)
 
-  def teardown_method(self):
-    notebook.connectors.hiveserver2.HS2Api = notebook.connectors.hiveserver2.original_HS2Api
+      cls.user = User.objects.get(username="test")
 
-    if originalCluster.FS_CACHE is None:
-      originalCluster.FS_CACHE = {}
-    originalCluster.FS_CACHE["default"] = self.original_fs
+      _grant_access_bulk("default", ("notebook", "beeswax", "hive"))
+      add_permission('test', 'has_adls', permname='adls_access', appname='filebrowser')
+
+  def setup_method(self):
+    self.client = _copy_client(self._cached_client)
 
   @pytest.mark.integration
   def test_export_result(self):
-    notebook_json = (
-      """
-      {
-        "selectedSnippet": "hive",
-        "showHistory": false,
-        "description": "Test Hive Query",
-        "name": "Test Hive Query",
-        "sessions": [
-            {
-                "type": "hive",
-                "properties": [],
-                "id": null
-            }
-        ],
-        "type": "query-hive",
-        "id": null,
-        "snippets": [{"id":"2b7d1f46-17a0-30af-efeb-33d4c29b1055","type":"hive","status":"running","statement":"""
-      """"select * from web_logs","properties":{"settings":[],"variables":[],"files":[],"functions":[]},"""
-      """"result":{"id":"b424befa-f4f5-8799-a0b4-79753f2552b1","type":"table","handle":"""
-      """{"log_context":null,"statements_count":1,"end":{"column":21,"row":0},"statement_id":0,"""
-      """"has_more_statements":false,"start":{"column":0,"row":0},"secret":"rVRWw7YPRGqPT7LZ/TeFaA==an","""
-      """"has_result_set":true,"statement":"select * from web_logs","operation_type":0,"modified_row_count":"""
-      """null,"guid":"7xm6+epkRx6dyvYvGNYePA==an"}},"lastExecuted": 1462554843817,"database":"default"}],
-        "uuid": "d9efdee1-ef25-4d43-b8f9-1a170f69a05a"
-    }
-    """
-    )
-
     response = self.client.post(
-      reverse('notebook:export_result'),
+      _URL_EXPORT_RESULT,
       {
-        'notebook': notebook_json,
-        'snippet': json.dumps(json.loads(notebook_json)['snippets'][0]),
+        'notebook': _EXPORT_NOTEBOOK_JSON,
+        'snippet': _EXPORT_SNIPPET_JSON,
         'format': json.dumps('hdfs-file'),
         'destination': json.dumps('/user/hue'),
         'overwrite': json.dumps(False),
@@ -556,10 +598,10 @@ class TestNotebookApiMocked(object):
     assert '/user/hue/Test Hive Query.csv' == data['watch_url']['destination'], data
 
     response = self.client.post(
-      reverse('notebook:export_result'),
+      _URL_EXPORT_RESULT,
       {
-        'notebook': notebook_json,
-        'snippet': json.dumps(json.loads(notebook_json)['snippets'][0]),
+        'notebook': _EXPORT_NOTEBOOK_JSON,
+        'snippet': _EXPORT_SNIPPET_JSON,
         'format': json.dumps('hdfs-file'),
         'destination': json.dumps('/user/hue/path.csv'),
         'overwrite': json.dumps(False),
@@ -572,10 +614,10 @@ class TestNotebookApiMocked(object):
 
     if is_adls_enabled():
       response = self.client.post(
-        reverse('notebook:export_result'),
+        _URL_EXPORT_RESULT,
         {
-          'notebook': notebook_json,
-          'snippet': json.dumps(json.loads(notebook_json)['snippets'][0]),
+          'notebook': _EXPORT_NOTEBOOK_JSON,
+          'snippet': _EXPORT_SNIPPET_JSON,
           'format': json.dumps('hdfs-file'),
           'destination': json.dumps('adl:/user/hue/path.csv'),
           'overwrite': json.dumps(False),
@@ -587,10 +629,10 @@ class TestNotebookApiMocked(object):
       assert 'adl:/user/hue/path.csv' == data['watch_url']['destination'], data
 
     response = self.client.post(
-      reverse('notebook:export_result'),
+      _URL_EXPORT_RESULT,
       {
-        'notebook': notebook_json,
-        'snippet': json.dumps(json.loads(notebook_json)['snippets'][0]),
+        'notebook': _EXPORT_NOTEBOOK_JSON,
+        'snippet': _EXPORT_SNIPPET_JSON,
         'format': json.dumps('hdfs-directory'),
         'destination': json.dumps('/user/hue/non_empty_directory'),
         'overwrite': json.dumps(False),
@@ -602,343 +644,282 @@ class TestNotebookApiMocked(object):
     assert 'The destination is not an empty directory!' == data['message'], data
 
   def test_download_result(self):
-    notebook_json = (
-      """
-      {
-        "selectedSnippet": "hive",
-        "showHistory": false,
-        "description": "Test Hive Query",
-        "name": "Test Hive Query",
-        "sessions": [
-            {
-                "type": "hive",
-                "properties": [],
-                "id": null
-            }
-        ],
-        "type": "query-hive",
-        "id": null,
-        "snippets": [{"id":"2b7d1f46-17a0-30af-efeb-33d4c29b1055","type":"hive","status":"running","statement":"""
-      """"select * from web_logs","properties":{"settings":[],"variables":[],"files":[],"functions":[]},"""
-      """"result":{"id":"b424befa-f4f5-8799-a0b4-79753f2552b1","type":"table","handle":{"log_context":null,"""
-      """"statements_count":1,"end":{"column":21,"row":0},"statement_id":0,"has_more_statements":false,"""
-      """"start":{"column":0,"row":0},"secret":"rVRWw7YPRGqPT7LZ/TeFaA==an","has_result_set":true,"statement":"""
-      """"select * from web_logs","operation_type":0,"modified_row_count":null,"guid":"7xm6+epkRx6dyvYvGNYePA==an"}},"""
-      """"lastExecuted": 1462554843817,"database":"default"}],
-        "uuid": "d9efdee1-ef25-4d43-b8f9-1a170f69a05a"
-    }
-    """
-    )
     response = self.client.post(
-      reverse('notebook:download'),
-      {'notebook': notebook_json, 'snippet': json.dumps(json.loads(notebook_json)['snippets'][0]), 'format': 'csv'},
+      _URL_DOWNLOAD,
+      {'notebook': _EXPORT_NOTEBOOK_JSON, 'snippet': _EXPORT_SNIPPET_JSON, 'format': 'csv'},
     )
     content = b"".join(response)
     assert len(content) > 0
 
 
-def test_get_interpreters_to_show():
-  default_interpreters = OrderedDict(
+_DEFAULT_INTERPRETERS = OrderedDict(
+  (
     (
-      (
-        'hive',
-        {
-          'name': 'Hive',
-          'displayName': 'Hive',
-          'interface': 'hiveserver2',
-          'type': 'hive',
-          'is_sql': True,
-          'options': {},
-          'dialect_properties': {},
-          'is_catalog': False,
-          'category': 'editor',
-          'dialect': 'hive',
-        },
-      ),
-      (
-        'impala',
-        {
-          'name': 'Impala',
-          'displayName': 'Impala',
-          'interface': 'hiveserver2',
-          'type': 'impala',
-          'is_sql': True,
-          'options': {},
-          'dialect_properties': {},
-          'is_catalog': False,
-          'category': 'editor',
-          'dialect': 'impala',
-        },
-      ),
-      (
-        'spark',
-        {
-          'name': 'Scala',
-          'displayName': 'Scala',
-          'interface': 'livy',
-          'type': 'spark',
-          'is_sql': False,
-          'options': {},
-          'dialect_properties': {},
-          'is_catalog': False,
-          'category': 'editor',
-          'dialect': 'spark',
-        },
-      ),
-      (
-        'pig',
-        {
-          'name': 'Pig',
-          'displayName': 'Pig',
-          'interface': 'pig',
-          'type': 'pig',
-          'is_sql': False,
-          'options': {},
-          'dialect_properties': {},
-          'is_catalog': False,
-          'category': 'editor',
-          'dialect': 'pig',
-        },
-      ),
-      (
-        'java',
-        {
-          'name': 'Java',
-          'displayName': 'Java',
-          'interface': 'oozie',
-          'type': 'java',
-          'is_sql': False,
-          'options': {},
-          'dialect_properties': {},
-          'is_catalog': False,
-          'category': 'editor',
-          'dialect': 'java',
-        },
-      ),
-    )
+      'hive',
+      {
+        'name': 'Hive',
+        'displayName': 'Hive',
+        'interface': 'hiveserver2',
+        'type': 'hive',
+        'is_sql': True,
+        'options': {},
+        'dialect_properties': {},
+        'is_catalog': False,
+        'category': 'editor',
+        'dialect': 'hive',
+      },
+    ),
+    (
+      'impala',
+      {
+        'name': 'Impala',
+        'displayName': 'Impala',
+        'interface': 'hiveserver2',
+        'type': 'impala',
+        'is_sql': True,
+        'options': {},
+        'dialect_properties': {},
+        'is_catalog': False,
+        'category': 'editor',
+        'dialect': 'impala',
+      },
+    ),
+    (
+      'spark',
+      {
+        'name': 'Scala',
+        'displayName': 'Scala',
+        'interface': 'livy',
+        'type': 'spark',
+        'is_sql': False,
+        'options': {},
+        'dialect_properties': {},
+        'is_catalog': False,
+        'category': 'editor',
+        'dialect': 'spark',
+      },
+    ),
+    (
+      'pig',
+      {
+        'name': 'Pig',
+        'displayName': 'Pig',
+        'interface': 'pig',
+        'type': 'pig',
+        'is_sql': False,
+        'options': {},
+        'dialect_properties': {},
+        'is_catalog': False,
+        'category': 'editor',
+        'dialect': 'pig',
+      },
+    ),
+    (
+      'java',
+      {
+        'name': 'Java',
+        'displayName': 'Java',
+        'interface': 'oozie',
+        'type': 'java',
+        'is_sql': False,
+        'options': {},
+        'dialect_properties': {},
+        'is_catalog': False,
+        'category': 'editor',
+        'dialect': 'java',
+      },
+    ),
   )
+)
 
-  expected_interpreters = OrderedDict(
+_EXPECTED_INTERPRETERS = OrderedDict(
+  (
     (
-      (
-        'java',
-        {
-          'name': 'Java',
-          'displayName': 'Java',
-          'interface': 'oozie',
-          'type': 'java',
-          'is_sql': False,
-          'options': {},
-          'dialect_properties': {},
-          'is_catalog': False,
-          'category': 'editor',
-          'dialect': 'java',
-        },
-      ),
-      (
-        'pig',
-        {
-          'name': 'Pig',
-          'displayName': 'Pig',
-          'interface': 'pig',
-          'is_sql': False,
-          'type': 'pig',
-          'options': {},
-          'dialect_properties': {},
-          'is_catalog': False,
-          'category': 'editor',
-          'dialect': 'pig',
-        },
-      ),
-      (
-        'hive',
-        {
-          'name': 'Hive',
-          'displayName': 'Hive',
-          'interface': 'hiveserver2',
-          'is_sql': True,
-          'type': 'hive',
-          'options': {},
-          'dialect_properties': {},
-          'is_catalog': False,
-          'category': 'editor',
-          'dialect': 'hive',
-        },
-      ),
-      (
-        'impala',
-        {
-          'name': 'Impala',
-          'displayName': 'Impala',
-          'interface': 'hiveserver2',
-          'type': 'impala',
-          'is_sql': True,
-          'options': {},
-          'dialect_properties': {},
-          'is_catalog': False,
-          'category': 'editor',
-          'dialect': 'impala',
-        },
-      ),
-      (
-        'spark',
-        {
-          'name': 'Scala',
-          'displayName': 'Scala',
-          'interface': 'livy',
-          'type': 'spark',
-          'is_sql': False,
-          'options': {},
-          'dialect_properties': {},
-          'is_catalog': False,
-          'category': 'editor',
-          'dialect': 'spark',
-        },
-      ),
-    )
+      'java',
+      {
+        'name': 'Java',
+        'displayName': 'Java',
+        'interface': 'oozie',
+        'type': 'java',
+        'is_sql': False,
+        'options': {},
+        'dialect_properties': {},
+        'is_catalog': False,
+        'category': 'editor',
+        'dialect': 'java',
+      },
+    ),
+    (
+      'pig',
+      {
+        'name': 'Pig',
+        'displayName': 'Pig',
+        'interface': 'pig',
+        'is_sql': False,
+        'type': 'pig',
+        'options': {},
+        'dialect_properties': {},
+        'is_catalog': False,
+        'category': 'editor',
+        'dialect': 'pig',
+      },
+    ),
+    (
+      'hive',
+      {
+        'name': 'Hive',
+        'displayName': 'Hive',
+        'interface': 'hiveserver2',
+        'is_sql': True,
+        'type': 'hive',
+        'options': {},
+        'dialect_properties': {},
+        'is_catalog': False,
+        'category': 'editor',
+        'dialect': 'hive',
+      },
+    ),
+    (
+      'impala',
+      {
+        'name': 'Impala',
+        'displayName': 'Impala',
+        'interface': 'hiveserver2',
+        'type': 'impala',
+        'is_sql': True,
+        'options': {},
+        'dialect_properties': {},
+        'is_catalog': False,
+        'category': 'editor',
+        'dialect': 'impala',
+      },
+    ),
+    (
+      'spark',
+      {
+        'name': 'Scala',
+        'displayName': 'Scala',
+        'interface': 'livy',
+        'type': 'spark',
+        'is_sql': False,
+        'options': {},
+        'dialect_properties': {},
+        'is_catalog': False,
+        'category': 'editor',
+        'dialect': 'spark',
+      },
+    ),
   )
+)
+_DEFAULT_INTERPRETER_VALUES = tuple(_DEFAULT_INTERPRETERS.values())
+_EXPECTED_INTERPRETER_VALUES = tuple(_EXPECTED_INTERPRETERS.values())
+
+
+def _set_for_testing(monkeypatch, config, value):
+  """
+  Same as config.set_for_testing(value), but reverted by monkeypatch instead of a reset callable.
+  """
+  monkeypatch.setitem(config.bind_to, config.grab_key, value)
+
+
+# Blacklist of the test run, restored after the tests that override it
+_APP_BLACKLIST = tuple(APP_BLACKLIST.get())
+
+
+@functools.lru_cache(maxsize=None)
+def _load_apps(app_blacklist):
+  appmanager.DESKTOP_MODULES = []
+  appmanager.DESKTOP_APPS = None
+  appmanager.load_apps(app_blacklist)
+  return tuple(appmanager.DESKTOP_MODULES), tuple(appmanager.DESKTOP_APPS)
+
 
+def _reload_apps(app_blacklist=None):
+  """
+  Resets the appmanager to the apps loaded with `app_blacklist` (the current APP_BLACKLIST by default), only discovering them once
+  per blacklist.
+  """
+  modules, apps = _load_apps(tuple(APP_BLACKLIST.get()) if app_blacklist is None else app_blacklist)
+  appmanager.DESKTOP_MODULES = list(modules)
+  appmanager.DESKTOP_APPS = list(apps)
+
+
+def test_get_interpreters_to_show(monkeypatch):
   try:
-    resets = [
-      INTERPRETERS.set_for_testing(default_interpreters),
-      APP_BLACKLIST.set_for_testing(''),
-      ENABLE_CONNECTORS.set_for_testing(False),
-      ENABLE_ALL_INTERPRETERS.set_for_testing(False),
-    ]
-    appmanager.DESKTOP_MODULES = []
-    appmanager.DESKTOP_APPS = None
-    appmanager.load_apps(APP_BLACKLIST.get())
+    _set_for_testing(monkeypatch, INTERPRETERS, _DEFAULT_INTERPRETERS)
+    _set_for_testing(monkeypatch, APP_BLACKLIST, '')
+    _set_for_testing(monkeypatch, ENABLE_CONNECTORS, False)
+    _set_for_testing(monkeypatch, ENABLE_ALL_INTERPRETERS, False)
+    _reload_apps()
     notebook.conf.INTERPRETERS_CACHE = None
 
     # 'get_interpreters_to_show should return the same as get_interpreters when interpreters_shown_on_wheel is unset'
-    assert list(default_interpreters.values()) == get_ordered_interpreters()
+    assert _DEFAULT_INTERPRETER_VALUES == tuple(get_ordered_interpreters())
 
-    resets.append(INTERPRETERS_SHOWN_ON_WHEEL.set_for_testing('java,pig'))
+    _set_for_testing(monkeypatch, INTERPRETERS_SHOWN_ON_WHEEL, 'java,pig')
 
     # 'get_interpreters_to_show did not return interpreters in the correct order expected'
     assert (
-      list(expected_interpreters.values()) == get_ordered_interpreters()
+      _EXPECTED_INTERPRETER_VALUES == tuple(get_ordered_interpreters())
     ), 'get_interpreters_to_show did not return interpreters in the correct order expected'
   finally:
-    for reset in resets:
-      reset()
-    appmanager.DESKTOP_MODULES = []
-    appmanager.DESKTOP_APPS = None
-    appmanager.load_apps(APP_BLACKLIST.get())
+    monkeypatch.undo()
+    _reload_apps(_APP_BLACKLIST)
     notebook.conf.INTERPRETERS_CACHE = None
 
 
-def test_get_ordered_interpreters():
+# Interpreters shown when ENABLE_ALL_INTERPRETERS is on with only hive, spark and oozie apps
+_EXPECTED_ALL = ('Hive', 'Scala', 'PySpark', 'R', 'Spark Submit Jar', 'Spark Submit Python', 'Text', 'Markdown')
+_name = itemgetter('name')
+
+_HIVE_APPS = {'hive': {}}  # Impala blacklisted indirectly
+_SPARK_APPS = {'hive': {}, 'spark': {}, 'oozie': {}}
+_PHOENIX = {'phoenix': {'name': 'Phoenix', 'interface': 'sqlalchemy', 'dialect': 'phoenix'}}
+_PYSPARK = {'pyspark': {'name': 'PySpark', 'interface': 'livy', 'dialect': 'pyspark'}}
+
+# (user apps, INTERPRETERS, ENABLE_ALL_INTERPRETERS, expected interpreter names)
+_ORDERED_INTERPRETERS_SCENARIOS = [
+  pytest.param(_HIVE_APPS, {}, False, ('Hive',), id='no-interpreter-added'),
+  pytest.param(_HIVE_APPS, _PHOENIX, False, ('Hive', 'Phoenix'), id='interpreter-added'),
+  # Explicitly added spark editor not seen when spark is blacklisted
+  pytest.param(_HIVE_APPS, _PYSPARK, False, ('Hive',), id='spark-added-spark-blacklisted'),
+  # No spark interpreter because ENABLE_ALL_INTERPRETERS is False
+  pytest.param(_SPARK_APPS, {}, False, ('Hive',), id='spark-whitelisted'),
+  # Explicitly added spark editor seen even when flag is False
+  pytest.param(_SPARK_APPS, _PYSPARK, False, ('Hive', 'PySpark'), id='spark-added-spark-whitelisted'),
+  pytest.param(_SPARK_APPS, {}, True, _EXPECTED_ALL, id='all-interpreters'),
+  pytest.param(_SPARK_APPS, _PHOENIX, True, _EXPECTED_ALL + ('Phoenix',), id='all-interpreters-interpreter-added'),
+]
+
+
+@pytest.fixture
+def ordered_interpreters_env(monkeypatch):
+  """
+  Apps loaded without blacklist and connectors off, restored with the original apps afterwards.
+  """
   try:
-    resets = [APP_BLACKLIST.set_for_testing(''), ENABLE_ALL_INTERPRETERS.set_for_testing(False)]
-    flag_reset = ENABLE_ALL_INTERPRETERS.set_for_testing(False)
-    appmanager.DESKTOP_MODULES = []
-    appmanager.DESKTOP_APPS = None
-    appmanager.load_apps(APP_BLACKLIST.get())
-
-    with patch('notebook.conf.appmanager.get_apps_dict') as get_apps_dict:
-      with patch('notebook.conf.has_connectors') as has_connectors:
-        get_apps_dict.return_value = {'hive': {}}  # Impala blacklisted indirectly
-        has_connectors.return_value = False
-        notebook.conf.INTERPRETERS_CACHE = None
-
-        # No interpreters explicitly added
-        INTERPRETERS.set_for_testing(OrderedDict(()))
-
-        assert [interpreter['name'] for interpreter in get_ordered_interpreters()] == ['Hive']
-        assert [interpreter['name'] for interpreter in get_ordered_interpreters()] == ['Hive']  # Check twice because of cache
-        notebook.conf.INTERPRETERS_CACHE = None
-
-        # Interpreter added explicitly
-        INTERPRETERS.set_for_testing(OrderedDict((('phoenix', {'name': 'Phoenix', 'interface': 'sqlalchemy', 'dialect': 'phoenix'}),)))
-        assert [interpreter['name'] for interpreter in get_ordered_interpreters()] == ['Hive', 'Phoenix']
-        assert [interpreter['name'] for interpreter in get_ordered_interpreters()] == ['Hive', 'Phoenix']  # Check twice
-        notebook.conf.INTERPRETERS_CACHE = None
-
-        # Add one of the spark editor explicitly when spark is blacklisted
-        INTERPRETERS.set_for_testing(OrderedDict((('pyspark', {'name': 'PySpark', 'interface': 'livy', 'dialect': 'pyspark'}),)))
-        # Explicitly added spark editor not seen when flag is False
-        assert [interpreter['name'] for interpreter in get_ordered_interpreters()] == ['Hive']
-        assert [interpreter['name'] for interpreter in get_ordered_interpreters()] == ['Hive']  # Check twice because of cache
-        notebook.conf.INTERPRETERS_CACHE = None
-
-        # Whitelist spark app and no explicit interpreter added
-        get_apps_dict.return_value = {'hive': {}, 'spark': {}, 'oozie': {}}
-
-        INTERPRETERS.set_for_testing(OrderedDict(()))
-        # No spark interpreter because ENABLE_ALL_INTERPRETERS is currently False
-        assert [interpreter['name'] for interpreter in get_ordered_interpreters()] == ['Hive']
-        assert [interpreter['name'] for interpreter in get_ordered_interpreters()] == ['Hive']  # Check twice because of cache
-        notebook.conf.INTERPRETERS_CACHE = None
-
-        # Add one of the spark editor explicitly
-        INTERPRETERS.set_for_testing(OrderedDict((('pyspark', {'name': 'PySpark', 'interface': 'livy', 'dialect': 'pyspark'}),)))
-        # Explicitly added spark editor seen even when flag is False
-        assert [interpreter['name'] for interpreter in get_ordered_interpreters()] == ['Hive', 'PySpark']
-        assert [interpreter['name'] for interpreter in get_ordered_interpreters()] == ['Hive', 'PySpark']  # Check twice because of cache
-        notebook.conf.INTERPRETERS_CACHE = None
-
-        flag_reset = ENABLE_ALL_INTERPRETERS.set_for_testing(True)  # Check interpreters when flag is True
-
-        INTERPRETERS.set_for_testing(OrderedDict(()))
-
-        assert [interpreter['name'] for interpreter in get_ordered_interpreters()] == [
-          'Hive',
-          'Scala',
-          'PySpark',
-          'R',
-          'Spark Submit Jar',
-          'Spark Submit Python',
-          'Text',
-          'Markdown',
-        ]
-        assert [interpreter['name'] for interpreter in get_ordered_interpreters()] == [
-          'Hive',
-          'Scala',
-          'PySpark',
-          'R',
-          'Spark Submit Jar',
-          'Spark Submit Python',
-          'Text',
-          'Markdown',
-        ]  # Check twice because of cache
-        notebook.conf.INTERPRETERS_CACHE = None
-
-        # Interpreter added explicitly when flag is True
-        INTERPRETERS.set_for_testing(OrderedDict((('phoenix', {'name': 'Phoenix', 'interface': 'sqlalchemy', 'dialect': 'phoenix'}),)))
-        assert [interpreter['name'] for interpreter in get_ordered_interpreters()] == [
-          'Hive',
-          'Scala',
-          'PySpark',
-          'R',
-          'Spark Submit Jar',
-          'Spark Submit Python',
-          'Text',
-          'Markdown',
-          'Phoenix',
-        ]
-        assert [interpreter['name'] for interpreter in get_ordered_interpreters()] == [
-          'Hive',
-          'Scala',
-          'PySpark',
-          'R',
-          'Spark Submit Jar',
-          'Spark Submit Python',
-          'Text',
-          'Markdown',
-          'Phoenix',
-        ]  # Check twice because of cache
+    _set_for_testing(monkeypatch, APP_BLACKLIST, '')
+    _reload_apps()
+    monkeypatch.setattr(notebook.conf, 'has_connectors', lambda: False)
+    notebook.conf.INTERPRETERS_CACHE = None
 
+    yield
   finally:
-    flag_reset()
-    for reset in resets:
-      reset()
-    appmanager.DESKTOP_MODULES = []
-    appmanager.DESKTOP_APPS = None
-    appmanager.load_apps(APP_BLACKLIST.get())
+    monkeypatch.undo()
+    _reload_apps(_APP_BLACKLIST)
     notebook.conf.INTERPRETERS_CACHE = None
 
 
+@pytest.mark.parametrize("apps, interpreters, enable_all, expected", _ORDERED_INTERPRETERS_SCENARIOS)
+def test_get_ordered_interpreters(ordered_interpreters_env, monkeypatch, apps, interpreters, enable_all, expected):
+  monkeypatch.setattr(appmanager, 'get_apps_dict', lambda user=None: apps)
+  _set_for_testing(monkeypatch, INTERPRETERS, interpreters)
+  _set_for_testing(monkeypatch, ENABLE_ALL_INTERPRETERS, enable_all)
+
+  assert tuple(map(_name, get_ordered_interpreters())) == expected
+  assert notebook.conf.INTERPRETERS_CACHE is not None and {'hive', *interpreters} <= set(notebook.conf.INTERPRETERS_CACHE)
+
+
 class TestQueriesMetrics(object):
   def test_queries_num(self):
     with patch('desktop.models.Document2.objects') as doc2_value_mock:
@@ -946,145 +927,106 @@ class TestQueriesMetrics(object):
       count = num_of_queries()
       assert 12500 == count
 
-      if not ENABLE_PROMETHEUS.get():
-        pytest.skip("Skipping Test")
+  @pytest.mark.skipif(not ENABLE_PROMETHEUS.get(), reason="Prometheus metrics are disabled")
+  def test_queries_num_metrics(self):
+    with patch('desktop.models.Document2.objects') as doc2_value_mock:
+      doc2_value_mock.filter.return_value.count.return_value = 12500
 
       c = Client()
       response = c.get('/metrics')
       assert b'hue_queries_numbers 12500.0' in response.content, response.content
 
 
-@pytest.mark.django_db
-class TestEditor(object):
-  def setup_method(self):
-    self.client = make_logged_in_client(username="test", groupname="empty", recreate=True, is_superuser=False)
-
-    self.user = User.objects.get(username="test")
+@pytest.fixture(scope="class")
+def editor_user(class_transaction, django_db_blocker):
+  """
+  Logged in client and user of the "empty" group that can only access impala.
+  """
+  with django_db_blocker.unblock():
+    client = make_logged_in_client(username="test", groupname="empty", recreate=True, is_superuser=False)
+    user = User.objects.get(username="test")
 
     grant_access("test", "empty", "impala")
 
-  def test_open_saved_impala_query_when_no_hive_interepreter(self):
-    try:
-      doc, created = Document2.objects.get_or_create(
-        name='open_saved_query_with_hive_not_present', type='query-impala', owner=self.user, data={}
-      )
-
-      with patch('desktop.middleware.fsmanager') as fsmanager:
-        response = self.client.get(reverse('notebook:editor'), {'editor': doc.id, 'is_embeddable': True})
-        assert 200 == response.status_code
-    finally:
-      doc.delete()
+  yield client, user
 
 
-@pytest.mark.django_db
-class TestPrivateURLPatterns():
-
-  def setup_method(self):
-    self.client = make_logged_in_client(username="api_user", recreate=True, is_superuser=False)
-    self.client_not_me = make_logged_in_client(username="not_api_user", recreate=True, is_superuser=False)
-
-    self.user = User.objects.get(username="api_user")
-    self.user_not_me = User.objects.get(username="not_api_user")
-
-  def test_autocomplete_databases(self):
-    """
-    Test the autocomplete URL for databases
-    """
-    response = self.client.post('/notebook/api/autocomplete/')
-    assert response.status_code == 200
-
-  def test_autocomplete_tables(self):
-    """
-    Test the autocomplete URL for tables in a specific database
-    """
-    # Test with a valid database name
-    response = self.client.post('/notebook/api/autocomplete/test_db')
-    assert response.status_code == 200
-
-    # Test with a special character in the database name
-    response = self.client.post('/notebook/api/autocomplete/test_db:-;test')
-    assert response.status_code == 200
-
-  def test_autocomplete_columns(self):
-    """
-    Test the autocomplete URL for columns in a specific table within a database
-    """
-    # Test with valid database and table names
-    response = self.client.post('/notebook/api/autocomplete/test_db/test_table')
-    assert response.status_code == 200
-
-    # Test with special characters in the database and table names
-    response = self.client.post('/notebook/api/autocomplete/test_db:-$@test/test_table:-$@test')
-    assert response.status_code == 200
-
-  def test_describe_database(self):
-    """
-    Test the describe URL for a specific database
-    """
-    # Test with a valid database name
-    response = self.client.post('/notebook/api/describe/test_db/')
-    assert response.status_code == 200
-
-    # Test with a special character in the database name
-    response = self.client.post('/notebook/api/describe/test_db:-$@test/')
-    assert response.status_code == 200
-
-  def test_describe_table(self):
-    """
-    Test the describe URL for a specific table in a database
-    """
-    # Test with valid database and table names
-    response = self.client.post('/notebook/api/describe/test_db/test_table/')
-    assert response.status_code == 200
-
-    # Test with special characters in the database and table names
-    response = self.client.post('/notebook/api/describe/test_db:-$@test/test_table:-$@test/')
-    assert response.status_code == 200
-
-  def test_describe_column(self):
-    """
-    Test the describe URL for a specific column in a table within a database
-    """
-    # Test with valid database, table, and column names
-    response = self.client.post('/notebook/api/describe/test_db/test_table/stats/test_column/')
-    assert response.status_code == 200
+@pytest.mark.django_db(transaction=False)
+class TestEditor(object):
+  @pytest.fixture(scope="class", autouse=True)
+  def _stub_fsmanager(self):
+    with patch('desktop.middleware.fsmanager'):
+      yield
 
-    # Test with special characters in the database, table, and column names
-    response = self.client.post('/notebook/api/describe/test_db:-$@test/test_table:-$@test/stats/test_column:-$@test/')
-    assert response.status_code == 200
+  @pytest.fixture(autouse=True)
+  def _inject(self, editor_user):
+    client, self.user = editor_user
+    self.client = _copy_client(client)
 
-  def test_sample_data_for_table(self):
-    """
-    Test the sample data URL for a specific table in a database
-    """
-    # Test with valid database and table names
-    response = self.client.post('/notebook/api/sample/test_db/test_table/')
-    assert response.status_code == 200
+  def test_open_saved_impala_query_when_no_hive_interepreter(self):
+    # Never saved, only the lookups of this id see it
+    doc = Document2(id=50020, name='open_saved_query_with_hive_not_present', type='query-impala', owner=self.user, data={})
+    get = Document2.objects.get
+
+    def get_doc(*args, **kwargs):
+      return doc if str(kwargs.get('id')) == str(doc.id) else get(*args, **kwargs)
+
+    with patch.object(Document2.objects, 'get', side_effect=get_doc):
+      response = self.client.get(_URL_EDITOR, {'editor': doc.id, 'is_embeddable': True})
+      assert 200 == response.status_code
+
+
+# (url, expected status) for each database/table/column/nested URL, with valid names and with special characters in the names
+_PRIVATE_URLS = [
+  ('/notebook/api/autocomplete/', 200),
+  ('/notebook/api/autocomplete/test_db', 200),
+  ('/notebook/api/autocomplete/test_db:-;test', 200),
+  ('/notebook/api/autocomplete/test_db/test_table', 200),
+  ('/notebook/api/autocomplete/test_db:-$@test/test_table:-$@test', 200),
+  ('/notebook/api/describe/test_db/', 200),
+  ('/notebook/api/describe/test_db:-$@test/', 200),
+  ('/notebook/api/describe/test_db/test_table/', 200),
+  ('/notebook/api/describe/test_db:-$@test/test_table:-$@test/', 200),
+  ('/notebook/api/describe/test_db/test_table/stats/test_column/', 200),
+  ('/notebook/api/describe/test_db:-$@test/test_table:-$@test/stats/test_column:-$@test/', 200),
+  ('/notebook/api/sample/test_db/test_table/', 200),
+  ('/notebook/api/sample/test_db:-$@test/test_table:-$@test/', 200),
+  ('/notebook/api/sample/test_db/test_table/test_column/', 200),
+  ('/notebook/api/sample/test_db:-$@test/test_table:-$@test/test_column:-$@test/', 200),
+  ('/notebook/api/sample/test_db/test_table/test_column/test_nested/', 200),
+  ('/notebook/api/sample/test_db:-$@test/test_table:-$@test/test_column:-$@test/test_nested:-$@test/', 200),
+]
+
+# Resolved on first use rather than at import, so that collecting this module does not load the whole URLconf
+_resolve = functools.lru_cache(maxsize=None)(resolve)
+
+
+@pytest.mark.django_db(transaction=False)
+class TestPrivateURLPatterns():
 
-    # Test with special characters in the database and table names
-    response = self.client.post('/notebook/api/sample/test_db:-$@test/test_table:-$@test/')
-    assert response.status_code == 200
+  @pytest.fixture(scope="class", autouse=True)
+  def setup_class_data(self, request, class_transaction, django_db_blocker):
+    cls = request.cls
 
-  def test_sample_data_for_column(self):
-    """
-    Test the sample data URL for a specific column in a table within a database
-    """
-    # Test with valid database, table, and column names
-    response = self.client.post('/notebook/api/sample/test_db/test_table/test_column/')
-    assert response.status_code == 200
+    with django_db_blocker.unblock():
+      # The views are called directly, so only the user is needed, not a session. get() and create_user() are the User manager
+      # paths that also map username when organizations are enabled.
+      try:
+        cls.user = User.objects.get(username="api_user")
+      except User.DoesNotExist:
+        cls.user = User.objects.create_user(username="api_user", password=None)
 
-    # Test with special characters in the database, table, and column names
-    response = self.client.post('/notebook/api/sample/test_db:-$@test/test_table:-$@test/test_column:-$@test/')
-    assert response.status_code == 200
+    cls.factory = RequestFactory()
 
-  def test_sample_data_for_nested(self):
+  @pytest.mark.parametrize("url, expected_status", _PRIVATE_URLS)
+  def test_private_url(self, url, expected_status):
     """
-    Test the sample data URL for a specific nested field in a column of a table within a database
+    Test that the autocomplete, describe and sample URLs resolve with valid names and with special characters in the names
     """
-    # Test with valid database, table, column, and nested field
-    response = self.client.post('/notebook/api/sample/test_db/test_table/test_column/test_nested/')
-    assert response.status_code == 200
+    view, args, kwargs = _resolve(url)
+    request = self.factory.post(url)
+    request.user = self.user
+    request.session = {}
 
-    # Test with special characters in the database, table, column, and nested field names
-    response = self.client.post('/notebook/api/sample/test_db:-$@test/test_table:-$@test/test_column:-$@test/test_nested:-$@test/')
-    assert response.status_code == 200
+    response = view(request, *args, **kwargs)
+    assert response.status_code == expected_status